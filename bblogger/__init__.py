@@ -1,7 +1,17 @@
 
-from bblogger.ble import scan, BlueBerryClient
-from bblogger.deserialize import BlueBerryDeserializer
-from bblogger.defs import SENSORS, PASSCODE_STATUS, enum2str
+from bblogger.defs import SENSORS, SENSOR_NAMES, CONFIG_FIELDS, PASSCODE_STATUS, enum2str
 from bblogger.__version__ import __version__
 
 
+def __getattr__(name):
+    # BLE (bleak) and protobuf modules are slow to import and not needed by
+    # e.g. `bblog --help`, import them on first use
+    if name in ("scan", "BlueBerryClient"):
+        from bblogger import ble
+        return getattr(ble, name)
+
+    if name == "BlueBerryDeserializer":
+        from bblogger.deserialize import BlueBerryDeserializer
+        return BlueBerryDeserializer
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -1,6 +1,8 @@
 import asyncio
 import logging
-from collections import OrderedDict
+import random
+import struct
+import time
 from platform import system
 from types import SimpleNamespace
 
@@ -17,6 +19,20 @@ from bblogger.outputwriter import mk_OutputWriter
 
 logger = logging.getLogger(__name__)
 
+# little endian uint32 used by all config characteristics
+_U32 = struct.Struct("<I")
+
+# connect retry backoff in seconds
+_BACKOFF_BASE = 1.0
+_BACKOFF_MAX = 30.0
+_BACKOFF_JITTER = 0.5
+
+# max age in seconds of a device found by scan() to be reused on connect
+_SCAN_CACHE_TTL = 5.0
+
+# (apiname, enable bit mask) for all configurable sensors
+_SENSOR_MASKS = tuple((name, s.enmask) for name, s in SENSORS.items())
+
 
 class ATimeoutEvent(asyncio.Event):
     """ 
@@ -36,6 +52,12 @@ class ATimeoutEvent(asyncio.Event):
 
         return True
 
+def _backoff_delay(attempt):
+    """ exponential backoff with jitter. attempt starts at 0 """
+    delay = _BACKOFF_BASE * (2 ** attempt) * (1 + random.uniform(0, _BACKOFF_JITTER))
+    return min(_BACKOFF_MAX, delay)
+
+
 class BlueBerryClient():
     """
     BlueBerry logger Bluetooth LE Client
@@ -46,13 +68,18 @@ class BlueBerryClient():
         if address is None:
             raise ValueError("invalid address")
         self._password = kwargs.get("password")
+        # max number of connect retries
+        self._retries = kwargs.get("retries") or 0
 
         timeout = kwargs.get("timeout", 5.0)
-        self._bc = BleakClient(address, timeout=timeout)
+        # a device from a recent scan() saves bleak a discovery on connect
+        dev = _cached_device(address)
+        self._bc = BleakClient(dev or address, timeout=timeout)
         self._evt_cmd = ATimeoutEvent()
-        self._evt_fetch = ATimeoutEvent()
-
-        self._err_fetch = None
+        # future set once when fetch is done (or failed)
+        self._fetch_done = None
+        # loop to signal waiters in. callbacks might run in a backend thread
+        self._loop = None
 
         try:
             self._bc.set_disconnected_callback(self._on_disconnect)
@@ -79,16 +106,40 @@ class BlueBerryClient():
                 )
             )
             return
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._abort_waiters)
+
+    def _abort_waiters(self):
         # abort if someone is waiting on notifications and device disconnect
         if not self._evt_cmd.is_set():
             self._evt_cmd.set()
 
-        if not self._evt_fetch.is_set():
-            self._evt_fetch.set()
+        fut = self._fetch_done
+        if fut is not None and not fut.done():
+            fut.set_result(None)
 
     async def connect(self):
         # called on enter
-        await self._bc.connect()
+        self._loop = asyncio.get_running_loop()
+
+        attempt = 0
+        while True:
+            try:
+                await self._bc.connect()
+                break
+            except (BleakError, asyncio.TimeoutError) as e:
+                if attempt >= self._retries:
+                    raise
+                delay = _backoff_delay(attempt)
+                attempt += 1
+                logger.warning(
+                    "Connect failed ({}). Retry {}/{} in {:.1f} sec".format(
+                        e, attempt, self._retries, delay
+                    )
+                )
+                await asyncio.sleep(delay)
+
         # TODO unlock only needed for same operations do it when needed
         await self._unlock(self._password)
         return True
@@ -127,38 +178,51 @@ class BlueBerryClient():
             pass
 
 
+    async def _stop_notify(self, cuuid):
+        """ stop notify unless the device disconnected """
+        # hide misleading error on unexpected disconnect
+        if self._bc.is_connected:
+            await self._bc.stop_notify(cuuid)
+        else:
+            logger.warning("Unexpected disconnect")
+
     async def _write_u32(self, cuuid, val):
-        val = int(val)
-        data = val.to_bytes(4, byteorder="little", signed=False)
+        data = _U32.pack(int(val))
         data = bytearray(data)  # fixes bug(!?) in txdbus ver 1.1.1
         await self._bc.write_gatt_char(cuuid, data, response=True)
 
     async def _read_u32(self, cuuid):
         ba = await self._bc.read_gatt_char(cuuid)
-        assert len(ba) == 4
-        return int.from_bytes(ba, byteorder="little", signed=False)
+        # raises struct.error if not 4 bytes
+        return _U32.unpack(ba)[0]
 
     async def _read_str(self, cuuid):
         """ read string """
         ba = await self._bc.read_gatt_char(cuuid)
         return ba.decode("utf-8") # or ascii
 
-    async def _cmd(self, txdata, rxsize=None):
-        """ first byte in txdata is the cmd id """
+    async def _cmd(self, txdata, rxsize=None, response=True):
+        """ first byte in txdata is the cmd id.
+        response=False skips the write ack if no rxdata expected """
         txuuid = UUIDS.C_CMD_TX
         rxuuid = UUIDS.C_CMD_RX
         # bytes object not supported in txdbus
         txdata = bytearray(txdata)
-        rxdata = bytearray()
         if not rxsize:
-            return await self._bc.write_gatt_char(txuuid, txdata, response=True)
+            return await self._bc.write_gatt_char(txuuid, txdata, response=response)
+
+        # preallocated, rxlen is number of bytes received
+        rxdata = bytearray(rxsize)
+        rxlen = 0
 
         self._evt_cmd.clear()
 
         def response_handler(sender, data):
-            rxdata.extend(data)
-            logger.debug("cmd RXD:{}".format(data))
-            self._evt_cmd.set()
+            nonlocal rxlen
+            rxdata[rxlen : rxlen + len(data)] = data
+            rxlen += len(data)
+            logger.debug("cmd RXD:%s", data)
+            self._loop.call_soon_threadsafe(self._evt_cmd.set)
 
         await self._bc.start_notify(rxuuid, response_handler)
         await self._bc.write_gatt_char(txuuid, txdata, response=True)
@@ -166,21 +230,33 @@ class BlueBerryClient():
         if not await self._evt_cmd.wait(6):
             logger.error("notification timeout")
 
-        # hide misleading error on unexpected disconnect
-        if self._bc.is_connected:
-            await self._bc.stop_notify(rxuuid)
-        else:
-            logger.warning("Unexpected disconnect")
-
-        await asyncio.sleep(2)  # TODO remove!?
+        await self._stop_notify(rxuuid)
 
-        assert len(rxdata) == rxsize
+        if rxlen != rxsize:
+            raise RuntimeError(
+                "Unexpected cmd response size {} (expected {})".format(
+                    rxlen, rxsize
+                )
+            )
 
-        if rxsize and rxdata[0] != (txdata[0] | 0x80):
+        if rxdata[0] != (txdata[0] | 0x80):
             raise RuntimeError("Unexpected cmd id in response {}".format(rxdata))
 
         return rxdata
 
+    async def _exchange_mtu(self):
+        """ request a larger ATT MTU. more log data per notification if the
+        device supports it. only BlueZ needs this, other backends negotiate
+        MTU on connect """
+        acquire_mtu = getattr(getattr(self._bc, "_backend", None), "_acquire_mtu", None)
+        if acquire_mtu is not None:
+            try:
+                await acquire_mtu()
+            except Exception as e:
+                logger.debug("MTU exchange failed: {}".format(e))
+
+        logger.debug("MTU size {}".format(getattr(self._bc, "mtu_size", "?")))
+
     async def _pw_write(self, s):
         """ password write.
         if pw_status is "init", set new password, 
@@ -214,14 +290,15 @@ class BlueBerryClient():
         """ blink LED on device """
         assert n > 0
         while n:
-            await self._cmd([CMD_OPCODE.BLINK_LED])
+            # no ack needed to blink
+            await self._cmd([CMD_OPCODE.BLINK_LED], response=False)
             n = n - 1
             if n > 0:
                 await asyncio.sleep(1)
 
     async def config_read(self, outfile=None, fmt=None, **kwargs):
 
-        conf = OrderedDict()
+        conf = {}
 
         val = await self._read_u32(UUIDS.C_CFG_LOG_ENABLE)
         conf["logging"] = bool(val)
@@ -235,8 +312,8 @@ class BlueBerryClient():
 
         enbits = await self._read_u32(UUIDS.C_CFG_SENSOR_ENABLE)
 
-        for name, s in SENSORS.items():
-            conf[s.apiname] = bool(s.enmask & enbits)
+        for name, enmask in _SENSOR_MASKS:
+            conf[name] = bool(enmask & enbits)
 
         out = mk_OutputWriter(outfile=outfile, fmt=fmt)
         out.write_kv(conf)
@@ -250,18 +327,15 @@ class BlueBerryClient():
         clrMask = 0
 
         # sanity check all params before write
-        for k, v in kwargs.items():
+        for name, enmask in _SENSOR_MASKS:
+            v = kwargs.get(name)
             if v is None:
                 continue
 
-            if k in SENSORS:
-                enmask = SENSORS[k].enmask
-                if v:
-                    setMask |= enmask
-                else:
-                    clrMask |= enmask
+            if v:
+                setMask |= enmask
             else:
-                logger.debug("Ignoring unknown config field '{}'".format(k))
+                clrMask |= enmask
 
         logging = kwargs.get("logging")
         if logging is not None:
@@ -325,47 +399,56 @@ class BlueBerryClient():
         else:
             raise ValueError("Invalid rtd")
 
-        bbd = BlueBerryDeserializer(outfile=outfile, fmt=fmt)
-        nentries = num
+        await self._exchange_mtu()
 
-        self._evt_fetch.clear()
-        self._err_fetch = None
-        def response_handler(sender, data):
-            # store exception and raise it later.
-            # can not raise it from this conext as asyncio will only
-            # print to stderr and continue execution.
-            # there is probably a bettwr way of doning this.
+        bbd = BlueBerryDeserializer(outfile=outfile, fmt=fmt)
+        # no limit if num not given. avoids a None check per notification
+        N = num or 2**31
+
+        loop = self._loop
+        fut = loop.create_future()
+        self._fetch_done = fut
+
+        def on_data(data):
+            if fut.done():
+                return
+            # can not raise exceptions from this context as asyncio will only
+            # print to stderr and continue execution. pass it on to the waiter.
             try:
-                done = bbd.putb(data)
+                if bbd.putb(data) or bbd.nentries >= N:
+                    fut.set_result(None)
             except Exception as e:
-                self._err_fetch = e
-                done = True
-
-            if nentries and bbd.nentries >= nentries:
-                done = True
+                fut.set_exception(e)
 
-            if done:
-                self._evt_fetch.set()
+        def response_handler(sender, data):
+            # might be called from a backend thread. copy as the backend
+            # might reuse the buffer and handle it in the loop. bytes as
+            # putb keeps it without another copy
+            loop.call_soon_threadsafe(on_data, bytes(data))
 
         await self._bc.start_notify(uuid_, response_handler)
 
-        timeout = None  # kwargs.get('timeout', 100)
-        if not await self._evt_fetch.wait(timeout):
-            logger.error("Notification timeout after %d sec" % timeout)
+        try:
+            await fut
+        finally:
+            self._fetch_done = None
+            bbd.close()
+            await self._stop_notify(uuid_)
 
-        # hide missleading error on unexpected disconnect
-        if self._bc.is_connected:
-            await self._bc.stop_notify(uuid_)
-        else:
-            logger.warning("Unexpected disconnect")
+            logger.debug("Fetched %d entries" % bbd.nentries)
 
-        logger.debug("Fetched %d entries" % bbd.nentries)
+_scan = SimpleNamespace(output=None, devices={}, address=None, found=None, cache={})
 
-        if self._err_fetch:
-            logger.debug("err %s" % str(self._err_fetch))
-            raise self._err_fetch
+def _cached_device(address):
+    """ BLEDevice seen by scan() within _SCAN_CACHE_TTL or None """
+    entry = _scan.cache.get(str(address).upper())
+    if entry is None:
+        return None
 
-_scan = SimpleNamespace(output=None, devices={})
+    t, dev = entry
+    if time.monotonic() - t > _SCAN_CACHE_TTL:
+        return None
+    return dev
 
 def _is_match(dev, advertisement_data):
 
@@ -389,21 +472,28 @@ def _scanner_callback(dev, advertisement_data):
     global _scan
 
     if not _is_match(dev, advertisement_data):
-        logger.debug("ignoring device={}".format(dev))
+        logger.debug("ignoring device=%s", dev)
         return
 
+    _scan.cache[dev.address.upper()] = (time.monotonic(), dev)
+
+    if _scan.address is not None and dev.address.upper() == _scan.address:
+        _scan.found.set()
+
     if dev.address in _scan.devices:
         # already printed
         return
     _scan.devices[dev.address] = dev
 
-    logger.debug("details={}, metadata={}".format(dev.details, dev.metadata))
+    logger.debug("details=%s, metadata=%s", dev.details, dev.metadata)
     row = (dev.address, str(dev.rssi), dev.name)
 
     _scan.output.write_row(row)
 
 
-async def scan(outfile=None, fmt=None, timeout=None, **kwargs):
+async def scan(outfile=None, fmt=None, timeout=None, address=None, **kwargs):
+    """ list BlueBerry devices until timeout. if address given, stop as soon
+    as that device is found """
     global _scan
 
     _scan.output = mk_OutputWriter(
@@ -412,20 +502,21 @@ async def scan(outfile=None, fmt=None, timeout=None, **kwargs):
         header=["ADDR", "RSSI", "NAME"],
         colwidths=[20, 10, 4]
     )
+    _scan.address = address.upper() if address else None
+    # new listing per scan, i.e. print devices again on repeated scans
+    _scan.devices = {}
+    _scan.found = ATimeoutEvent()
 
     scanner = BleakScanner(_scanner_callback)
 
     await scanner.start()
 
     try:
-        if timeout:
-            await asyncio.sleep(timeout)
-        else:
-            while True:
-                await asyncio.sleep(1)
+        await _scan.found.wait(timeout or None)
 
     except KeyboardInterrupt:
         pass
 
     await scanner.stop()
+    _scan.output.close()
 
@@ -5,14 +5,9 @@ import logging
 import asyncio
 import sys
 import argparse
-import traceback
 import signal
-import functools
-import atexit
-import json
-from pprint import pprint
 
-from os.path import realpath, abspath, expanduser, dirname, exists
+from os.path import realpath, abspath, expanduser, dirname, exists, basename
 import bblogger as bbl
 
 logger = logging.getLogger(__name__)
@@ -30,9 +25,20 @@ async def do_config_read(**kwargs):
     async with bbl.BlueBerryClient(**kwargs) as bbc:
         conf = await bbc.config_read(**kwargs)
 
+def config_fields(kwargs):
+    """ given (not None) config fields in kwargs """
+    return {k: kwargs[k] for k in bbl.CONFIG_FIELDS if kwargs.get(k) is not None}
+
 async def do_config_write(**kwargs):
+    # only pass on given config fields, not all other args
+    conf = config_fields(kwargs)
+    # nothing to write, no need to connect
+    if not conf:
+        logger.error("No config fields given")
+        sys.exit(1)
+
     async with bbl.BlueBerryClient(**kwargs) as bbc:
-        await bbc.config_write(**kwargs)
+        await bbc.config_write(**conf)
 
 async def do_set_password(**kwargs):
     password = kwargs.get("password")
@@ -47,8 +53,24 @@ async def do_device_info(**kwargs):
         await bbc.device_info(**kwargs)
 
 async def do_fetch(**kwargs):
-    async with bbl.BlueBerryClient(**kwargs) as bbc:
-        await bbc.fetch(ofile=kwargs.get("outfile"), **kwargs)
+    outfile = kwargs.get("outfile")
+    # keep stdout line buffered on a terminal (real-time data) but use a
+    # large buffer when piped, as for --outfile
+    if outfile is sys.stdout and not outfile.isatty():
+        outfile.flush()
+        kwargs["outfile"] = open(
+            outfile.fileno(),
+            "w",
+            buffering=OUTFILE_BUFSIZE,
+            encoding=outfile.encoding,
+            closefd=False,
+        )
+    try:
+        async with bbl.BlueBerryClient(**kwargs) as bbc:
+            await bbc.fetch(**kwargs)
+    finally:
+        if kwargs["outfile"] is not outfile:
+            kwargs["outfile"].close()  # flush, stdout fd is kept open
 
 async def do_calibrate(**kwargs):
     pass
@@ -61,7 +83,7 @@ async def do_dfu(address, package, boot, **kwargs):
     from bblogger.dfu import device_firmware_upgrade, app_to_dfu_address, scan_dfu_devices
 
     if kwargs.get("scan"):
-        scan_dfu_devices()
+        await scan_dfu_devices()
         return
 
     if address is None:
@@ -94,30 +116,64 @@ async def do_dfu(address, package, boot, **kwargs):
     logger.info("DFU ...")
     await device_firmware_upgrade(dfu_addr=dfu_addr, package=package)
 
-def parse_args():
-    def type_password(s):
-        if s is None:
-            return None
-        msg = "Password must be 8 chars and ascii only"
-        try:
-            ba = bytearray(s.encode("ascii"))
-        except UnicodeDecodeError:
-            raise argparse.ArgumentTypeError(msg)
-        if len(ba) != 8:
-            raise argparse.ArgumentTypeError(msg)
-        return ba
-
-    def type_uint(s):
-        """ parse to unsigned (positive) int """
-        i = int(s)
-        if i < 0:
-            raise argparse.ArgumentTypeError("%s is an not a positive int value" % s)
-        return i
-
-    def type_fullpath(s):
-        """ expand "~" and relative paths """
-        return abspath(expanduser(s))
+def type_password(s):
+    if s is None:
+        return None
+    msg = "Password must be 8 chars and ascii only"
+    try:
+        ba = bytearray(s.encode("ascii"))
+    except UnicodeDecodeError:
+        raise argparse.ArgumentTypeError(msg)
+    if len(ba) != 8:
+        raise argparse.ArgumentTypeError(msg)
+    return ba
+
+def type_uint(s):
+    """ parse to unsigned (positive) int """
+    i = int(s)
+    if i < 0:
+        raise argparse.ArgumentTypeError("%s is an not a positive int value" % s)
+    return i
+
+def type_fullpath(s):
+    """ expand "~" and relative paths """
+    return abspath(expanduser(s))
+
+# output file buffer size. fetch writes one small row per log entry
+OUTFILE_BUFSIZE = 1 << 16
+
+def type_outfile(s):
+    if s is None:
+        return sys.stdout
+    s = realpath(s)
+    if exists(s):
+        # TODO open file, check exists etc
+        return open(s, "a", buffering=OUTFILE_BUFSIZE) # append
+    else:
+        return open(s, "w", buffering=OUTFILE_BUFSIZE)
+
+
+BOOL_CHOICES = {
+        "y": True, 
+        "n": False, 
+        "1": True, 
+        "0": False, 
+        "on": True, 
+        "off": False
+        }
+_BOOL_CHOICES_MSG = "Valid options are {}".format(", ".join(BOOL_CHOICES))
+
+def onoffbool(s):
+    try:
+        return BOOL_CHOICES[s]
+    except KeyError:
+        raise argparse.ArgumentTypeError(_BOOL_CHOICES_MSG)
 
+onoffbool.__name__ = "on|off"
+
+
+def _mk_common_parser():
+    """ arguments shared by all subcommands """
     common = argparse.ArgumentParser(add_help=False)
     common.add_argument(
         "--verbose", 
@@ -134,16 +190,12 @@ def parse_args():
         help="Timeout in seconds. useful for batch jobs",
     )
 
-    def type_outfile(s):
-        if s is None:
-            return sys.stdout
-        s = realpath(s)
-        if exists(s):
-            # TODO open file, check exists etc
-            return open(s, "a") # append
-        else:
-            return open(s, "w")
-
+    common.add_argument(
+        "--retries",
+        type=type_uint,
+        default=0,
+        help="Max number of connect retries (with increasing delay). Default 0",
+    )
 
     common.add_argument("--outfile", 
             default=sys.stdout,
@@ -171,81 +223,35 @@ def parse_args():
         metavar="ADDR",
         help="Bluetooth LE device address (or device UUID on MacOS)",
     )
+    return common
 
-    parser = argparse.ArgumentParser(description="", add_help=False)
-    subparsers = parser.add_subparsers()
-    sps = []
-
-    parser.add_argument(
-        "--help", "-h",
-        action="store_true",
-        help="Show this help message and exit"
-    )
-
-    parser.add_argument(
-        "--version",
-        action="store_true",
-        help="Show version info and exit"
-    )
 
-    # ---- SCAN --------------------------------------------------------------
-    sp = subparsers.add_parser(
-        "scan", 
-        parents=[common], 
-        description="Show list of BlueBerry logger devices"
-    )
+# ---- SCAN --------------------------------------------------------------
+def _build_scan(sp):
     sp.set_defaults(_actionfunc=do_scan)
-    sps.append(sp)
 
-    # ---- BLINK -------------------------------------------------------------
-    sp = subparsers.add_parser(
-        "blink",
-        parents=[common],
-        description="Blink LED on device for physical identification",
-    )
+
+# ---- BLINK -------------------------------------------------------------
+def _build_blink(sp):
     sp.set_defaults(_actionfunc=do_blink)
 
     sp.add_argument(
         "--num", "-n", metavar="N", type=type_uint, default=1, 
         help="Number of blinks"
     )
-    sps.append(sp)
 
-    # ---- CONFIG READ ------------------------------------------------------
-    sp = subparsers.add_parser(
-        "config-read", 
-        parents=[common], 
-        description="Get device configuration"
-    )
+
+# ---- CONFIG READ ------------------------------------------------------
+def _build_config_read(sp):
     sp.set_defaults(_actionfunc=do_config_read)
-    sps.append(sp)
-
-    # ---- CONFIG WRITE ------------------------------------------------------
-    BOOL_CHOICES = {
-            "y": True, 
-            "n": False, 
-            "1": True, 
-            "0": False, 
-            "on": True, 
-            "off": False
-            }
-
-    def onoffbool(s):
-        if s not in BOOL_CHOICES:
-            msg = "Valid options are {}".format(BOOL_CHOICES.keys())
-            raise argparse.ArgumentTypeError(msg)
-        return BOOL_CHOICES[s]
 
-    sp = subparsers.add_parser(
-        "config-write",
-        parents=[common],
-        description="Configure device"
-    )
+
+# ---- CONFIG WRITE ------------------------------------------------------
+def _build_config_write(sp):
     sp.set_defaults(_actionfunc=do_config_write)
     cfa = sp.add_argument_group("Config fields", description="")
 
-    sensor_names = list(bbl.SENSORS.keys())
-    for s in sensor_names:
+    for s in bbl.SENSOR_NAMES:
         cfa.add_argument(
             "--{}".format(s),
             metavar="ONOFF",
@@ -263,33 +269,20 @@ def parse_args():
     cfa.add_argument(
         "--interval", type=type_uint, help="Global log interval in seconds"
     )
-    sps.append(sp)
 
-    # ---- CONFIG-PASSWORD ---------------------------------------------------
-    sp = subparsers.add_parser(
-        "set-password",
-        parents=[common],
-        description="Enable password protection on device. \
-            can only be used after device power cycle.",
-    )
+
+# ---- CONFIG-PASSWORD ---------------------------------------------------
+def _build_set_password(sp):
     sp.set_defaults(_actionfunc=do_set_password)
-    sps.append(sp)
 
-    # ---- DEVICE-INFO---------------------------------------------------
-    sp = subparsers.add_parser(
-        "device-info",
-        parents=[common],
-        description="Get device information. Firmware version etc"
-    )
+
+# ---- DEVICE-INFO---------------------------------------------------
+def _build_device_info(sp):
     sp.set_defaults(_actionfunc=do_device_info)
-    sps.append(sp)
 
-    # ---- FETCH -------------------------------------------------------------
-    sp = subparsers.add_parser(
-        "fetch",
-        parents=[common],
-        description="Fetch sensor data"
-    )
+
+# ---- FETCH -------------------------------------------------------------
+def _build_fetch(sp):
     sp.set_defaults(_actionfunc=do_fetch)
     sp.add_argument(
         "--rtd",
@@ -308,25 +301,15 @@ def parse_args():
         type=type_uint,
         help="Max number of data points or log entries to fetch",
     )
-    sps.append(sp)
 
-    # ---- CALIBRATE -------------------------------------------------------
-    # sp = subparsers.add_parser(
-        # "calibrate",
-        # parents=[common],
-        # description="Calibrate sensor(s)"
-    # )
 
+# ---- CALIBRATE -------------------------------------------------------
+# def _build_calibrate(sp):
     # sp.set_defaults(_actionfunc=do_calibrate)
-    # sps.append(sp)
 
-    # ---- DFU -------------------------------------------------------------
-    sp = subparsers.add_parser(
-        "dfu",
-        parents=[common],
-        description="Device firmware upgrade"
-    )
 
+# ---- DFU -------------------------------------------------------------
+def _build_dfu(sp):
     sp.add_argument(
         "--boot",
         #action="store_true",
@@ -354,20 +337,95 @@ def parse_args():
         help="Scan and list devices in DFU mode. Might show unrelated devices."
     )
     sp.set_defaults(_actionfunc=do_dfu)
-    sps.append(sp)
+
+
+# subcommands in help order. {name: (description, builder)}
+_BUILDERS = {
+    "scan": ("Show list of BlueBerry logger devices", _build_scan),
+    "blink": ("Blink LED on device for physical identification", _build_blink),
+    "config-read": ("Get device configuration", _build_config_read),
+    "config-write": ("Configure device", _build_config_write),
+    "set-password": (
+        "Enable password protection on device. \
+            can only be used after device power cycle.",
+        _build_set_password,
+    ),
+    "device-info": (
+        "Get device information. Firmware version etc", 
+        _build_device_info
+    ),
+    "fetch": ("Fetch sensor data", _build_fetch),
+    # "calibrate": ("Calibrate sensor(s)", _build_calibrate),
+    "dfu": ("Device firmware upgrade", _build_dfu),
+}
+
+
+def _parse_args_fast(argv):
+    """ 
+    parse args for the selected subcommand without constructing all other
+    subparsers. returns None if the full parser is needed (help etc.)
+    """
+    if not argv or argv[0] not in _BUILDERS:
+        return None
+
+    if any(a in ("--help", "-h", "--version") for a in argv):
+        return None
+
+    name = argv[0]
+    description, build = _BUILDERS[name]
+    sp = argparse.ArgumentParser(
+        prog="{} {}".format(basename(sys.argv[0]), name),
+        parents=[_mk_common_parser()],
+        description=description,
+    )
+    build(sp)
+    sp.set_defaults(help=False, version=False)
+
+    return vars(sp.parse_args(argv[1:]))
+
+
+def parse_args():
+    args = _parse_args_fast(sys.argv[1:])
+    if args is not None:
+        return args
+
+    common = _mk_common_parser()
+
+    parser = argparse.ArgumentParser(description="", add_help=False)
+    subparsers = parser.add_subparsers()
+    sps = []
+
+    parser.add_argument(
+        "--help", "-h",
+        action="store_true",
+        help="Show this help message and exit"
+    )
+
+    parser.add_argument(
+        "--version",
+        action="store_true",
+        help="Show version info and exit"
+    )
+    # no subcommand given
+    parser.set_defaults(verbose=0, _actionfunc=None)
+
+    for name, (description, build) in _BUILDERS.items():
+        sp = subparsers.add_parser(
+            name,
+            parents=[common],
+            description=description
+        )
+        build(sp)
+        sps.append(sp)
 
     args = parser.parse_args()
 
     if args.help:
-        for sp in sps:
-            print(sp.format_help())
-            print()  # extra linebreak
+        # extra linebreak between subcommands
+        sys.stdout.write("".join(sp.format_help() + "\n\n" for sp in sps))
 
         parser.exit()
 
-    if "verbose" not in args:
-        args.verbose = 0
-
     return vars(args)
 
 
@@ -392,7 +450,18 @@ def print_versions():
         print("bluez:", s)
 
 
+# log level by verbose level (-v count). 3 and above is debug
+_VERBOSE_TO_LEVEL = (logging.WARNING, logging.WARNING, logging.INFO, logging.DEBUG)
+# last verbose level set, None if never set
+_verbose_level = None
+
 def set_verbose(verbose_level):
+    global _verbose_level
+    # same level again would only add duplicate handlers
+    if verbose_level == _verbose_level:
+        return
+    _verbose_level = verbose_level
+
     loggers = [logging.getLogger("bblogger"), logger]
 
     for name in logging.root.manager.loggerDict:
@@ -402,12 +471,7 @@ def set_verbose(verbose_level):
              if x not in loggers:
                  loggers.append(x)
 
-    if verbose_level <= 1:
-        level = logging.WARNING
-    if verbose_level == 2:
-        level = logging.INFO
-    elif verbose_level >= 3:
-        level = logging.DEBUG
+    level = _VERBOSE_TO_LEVEL[min(verbose_level, 3)]
 
     if verbose_level >= 4:
         bleak_logger = logging.getLogger("bleak")
@@ -426,36 +490,44 @@ def set_verbose(verbose_level):
 def cancel_tasks():
     # Cancel all task to ensure all connections closed.  Otherwise devices
     # can be tied to "zombie connections" and not visible on next scan/connect.
-    for task in asyncio.Task.all_tasks():
-        if task is asyncio.tasks.Task.current_task():
+    for task in asyncio.all_tasks():
+        if task is asyncio.current_task():
             continue
         task.cancel()
 
 def signal_handler(signo):
     cancel_tasks()
 
+async def run_action(actionfunc, args):
+    loop = asyncio.get_running_loop()
+    # signal.SIGHUP unix only
+    for signo in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(signo, signal_handler, signo)
+
+    await actionfunc(**args)
+
 
 def main():
     args = parse_args()
 
     verbose_level = args["verbose"]
     set_verbose(verbose_level)
-    logger.debug("args={}".format(args))
+    logger.debug("args=%s", args)
 
-    if args.get("version"):
+    if args["version"]:
         print_versions()
         exit(0)
 
-    actionfunc = args.get("_actionfunc")
-    if not actionfunc:
+    actionfunc = args["_actionfunc"]
+    if actionfunc is None:
         return
 
-    loop = asyncio.get_event_loop()
-    # signal.SIGHUP unix only
-    for signo in [signal.SIGINT, signal.SIGTERM]:
-        loop.add_signal_handler(signo, signal_handler, signo)
-
-    loop.run_until_complete(actionfunc(**args))
+    outfile = args.get("outfile")
+    try:
+        asyncio.run(run_action(actionfunc, args))
+    finally:
+        if outfile is not None and outfile is not sys.stdout:
+            outfile.close()
 
 
 if __name__ == "__main__":
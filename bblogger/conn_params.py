@@ -38,14 +38,23 @@
 #
 # Easiest to tell systemd to do this at startup.
 
+import os
 from os import path, mkdir, geteuid
 from platform import system
+from functools import lru_cache
 import logging
 
 logger = logging.getLogger(__name__)
 
 _BT_SERVICE_DIR = "/etc/systemd/system/bluetooth.service.d"
 _BT_SERVICE_FILE = "/etc/systemd/system/bluetooth.service.d/10-set-conn_interval.conf"
+# service file content
+_BT_SERVICE_TEMPLATE = (
+    "# Setting default conn_max_interval\n"
+    "# to avoid disconnect of some BLE devices that require it\n"
+    "[Service]\n"
+    "ExecStartPre=/bin/bash -c 'echo {vmax} > {path}'\n"
+)
 
 
 def _raw2ms(x):
@@ -53,32 +62,43 @@ def _raw2ms(x):
     return x * 1.25
 
 
-def _debugfs_path(hci, prop):
-
+@lru_cache(maxsize=1)
+def _check_env():
+    """ raises if debugfs not accessible. can not change during a run """
     if system() != "Linux":
         raise RuntimeError("Linux only")
 
     if geteuid() != 0:
         raise RuntimeError("Need root for this. try sudo")
 
+
+@lru_cache(maxsize=16)
+def _debugfs_path(hci, prop):
+    _check_env()
+
     btd = "/sys/kernel/debug/bluetooth/"
     path_ = path.join(btd, hci, prop)
-    # check exists always in case of write
+    # checked once per (hci, prop). a missing path raises and is not cached
     if not path.exists(path_):
         raise RuntimeError("No such path %s" % path_)
     return path_
 
 
 def _debugfs_set(hci, prop, val):
-    path_ = _debugfs_path(hci, prop)
-    with open(path_, "w") as f:
-        f.write(str(int(val)))
+    # plain fd write, no need for python text/buffered I/O for a single int
+    fd = os.open(_debugfs_path(hci, prop), os.O_WRONLY)
+    try:
+        os.write(fd, str(int(val)).encode("ascii"))
+    finally:
+        os.close(fd)
 
 
 def _debugfs_get(hci, prop):
-    path_ = _debugfs_path(hci, prop)
-    with open(path_) as f:
-        val = f.readline()
+    fd = os.open(_debugfs_path(hci, prop), os.O_RDONLY)
+    try:
+        val = os.read(fd, 32)
+    finally:
+        os.close(fd)
     return int(val.strip())
 
 
@@ -112,31 +132,18 @@ def _create_service(hci="hci0", vmax=160):
     if not path.exists(_BT_SERVICE_DIR):
         mkdir(_BT_SERVICE_DIR)
 
-    vmax_ms = vmax * 1.25
-
     logger.debug(
         "Setting default conn_max_interval to %d (%f ms)" % (vmax, _raw2ms(vmax))
     )
     vmaxpath = _debugfs_path(hci, "conn_max_interval")
-    # service content
-    lines = [
-        "# Setting default conn_max_interval",
-        "# to avoid disconnect of some BLE devices that require it",
-        "[Service]",
-        "ExecStartPre=/bin/bash -c 'echo {} > {}'".format(vmax, vmaxpath),
-        "",
-    ]
-
-    logger.debug("---- BEGIN %s ----" % _BT_SERVICE_FILE)
-    for line in lines:
-        logger.debug(line)
-    logger.debug("---- END ----")
+    content = _BT_SERVICE_TEMPLATE.format(vmax=vmax, path=vmaxpath)
+
+    logger.debug("---- BEGIN %s ----\n%s---- END ----", _BT_SERVICE_FILE, content)
     with open(_BT_SERVICE_FILE, "w") as f:
-        f.write("\n".join(lines))
+        f.write(content)
 
     # update it now and let the service do it next time after reboot
-    with open(vmaxpath, "w") as f:
-        f.write(str(int(vmax)))
+    _debugfs_set(hci, "conn_max_interval", vmax)
 
 
 def main():
@@ -1,4 +1,5 @@
 from enum import Enum, IntEnum
+from sys import intern
 
 
 # temporary fix as uuid not (yet) suported in bleak MacOS backend, only str works
@@ -109,7 +110,8 @@ class _BlueBerryLogEntryField:
         pbname,
         symbol="",
         unit="",
-        tounit=None,
+        scale=None,
+        div=1.0,
         alias=None,
         subfields=None,
         txtfmt="4.3f",
@@ -119,21 +121,33 @@ class _BlueBerryLogEntryField:
             enmask: enable bit mask
             pbname: protobuf descriptor field name 
             symbol: SI symbol or similar identifier
-            tounit: func to convert from raw value
+            scale, div: convert from raw value as raw * scale / div.
+                no conversion if scale is None
         """
 
         self.enmask = enmask
         self.pbname = pbname
         self.symbol = symbol
         self.unit = unit
-        self.tounit = tounit
+        self.scale = scale
+        self.div = div
         self.txtfmt = "{{0: {}}}".format(txtfmt)
         self.apiname = alias if alias else pbname
 
+        # interned, the row keys tuples are built from these names and
+        # compared per message
         if subfields:
-            self.colnames = ["{}_{}".format(self.symbol, x) for x in subfields]
+            self.colnames = tuple(
+                intern("{}_{}".format(self.symbol, x)) for x in subfields
+            )
         else:
-            self.colnames = [self.symbol]
+            self.colnames = (intern(self.symbol),)
+
+    def tounit(self, x):
+        """ convert from raw value """
+        if self.scale is None:
+            return x
+        return x * self.scale / self.div
 
     def is_configurable(self):
         return self.enmask is not None
@@ -168,14 +182,16 @@ class BlueBerryLogEntryFields(Enum):
         pbname="pressure",
         symbol="p",
         unit="hPa",
-        tounit=lambda x: x / 100.0,
+        scale=1.0,
+        div=100.0,
     )
     HUMIDITY = _BlueBerryLogEntryField(
         enmask=0x0002,
         pbname="rh",
         symbol="rh",
         unit="%",
-        tounit=lambda x: x / 10.0,
+        scale=1.0,
+        div=10.0,
         alias="humid",
     )
     TEMPERATURE = _BlueBerryLogEntryField(
@@ -183,7 +199,8 @@ class BlueBerryLogEntryFields(Enum):
         pbname="temperature",
         symbol="t",
         unit="C",
-        tounit=lambda x: x / 1000.0,
+        scale=1.0,
+        div=1000.0,
         alias="temp",
     )
     COMPASS = _BlueBerryLogEntryField(
@@ -191,7 +208,8 @@ class BlueBerryLogEntryFields(Enum):
         pbname="compass",
         symbol="m",
         unit="uT",
-        tounit=lambda x: x * 4915.0 / 32768.0,
+        scale=4915.0,
+        div=32768.0,
         subfields=("x", "y", "z"),
     )
     ACCELEROMETER = _BlueBerryLogEntryField(
@@ -199,7 +217,8 @@ class BlueBerryLogEntryFields(Enum):
         pbname="accelerometer",
         symbol="a",
         unit="m/s^2",
-        tounit=lambda x: x * 2.0 * 9.81 / 32768.0,
+        scale=2.0 * 9.81,
+        div=32768.0,
         alias="accel",
         subfields=("x", "y", "z"),
     )
@@ -208,7 +227,8 @@ class BlueBerryLogEntryFields(Enum):
         pbname="gyro",
         symbol="g",
         unit="dps",
-        tounit=lambda x: x * 250.0 / 32768.0,
+        scale=250.0,
+        div=32768.0,
         subfields=("x", "y", "z"),
     )
     LUX = _BlueBerryLogEntryField(
@@ -216,7 +236,8 @@ class BlueBerryLogEntryFields(Enum):
         pbname="lux",
         symbol="L",
         unit="lux",
-        tounit=lambda x: x / 1000.0,
+        scale=1.0,
+        div=1000.0,
         # alias="illuminance"
     )
     UVI = _BlueBerryLogEntryField(
@@ -224,14 +245,16 @@ class BlueBerryLogEntryFields(Enum):
         pbname="uvi",
         symbol="UVi",
         unit="",  # FIXME
-        tounit=lambda x: x / 1000.0,
+        scale=1.0,
+        div=1000.0,
     )
     BATVOLT = _BlueBerryLogEntryField(
         enmask=0x0200,
         pbname="battery_mv",
         symbol="bat",
         unit="V",
-        tounit=lambda x: x / 1000.0,
+        scale=1.0,
+        div=1000.0,
         alias="batvolt",
     )
     TIME = _BlueBerryLogEntryField(
@@ -239,7 +262,7 @@ class BlueBerryLogEntryFields(Enum):
         pbname="timestamp",
         symbol="TS",
         unit="s",
-        tounit=lambda x: float(x),
+        scale=1.0,
         txtfmt="7.0f",
     )
     _GPIO0ADC = _BlueBerryLogEntryField(
@@ -247,14 +270,14 @@ class BlueBerryLogEntryFields(Enum):
         pbname="gpio0_mv",
         symbol="gp0",
         unit="mV",
-        tounit=lambda x: x * 1.0,
+        scale=1.0,
     )
     _GPIO1ADC = _BlueBerryLogEntryField(
         enmask=None,
         pbname="gpio1_mv",
         symbol="gp1",
         unit="mV",
-        tounit=lambda x: x * 1.0,
+        scale=1.0,
     )
 
     _INT_GPIO0 = _BlueBerryLogEntryField(
@@ -262,30 +285,34 @@ class BlueBerryLogEntryFields(Enum):
         pbname="int_gpio0",
         symbol="int0",
         unit="",
-        tounit=lambda x: x,
     )
     _INT_GPIO1 = _BlueBerryLogEntryField(
         enmask=None,
         pbname="int_gpio1",
         symbol="int1",
         unit="",
-        tounit=lambda x: x,
     )
     _INT_ACC = _BlueBerryLogEntryField(
         enmask=None,
         pbname="int_acc",
         symbol="iacc1",
         unit="",
-        tounit=lambda x: x,
     )
 
+# enum class -> {value: name}, filled on first enum2str() use of a class
+_ENUM_NAMES = {}
+
 def enum2str(enumclass, val):
     """
     enumclass - a Enum class, either instance or class 
     """
+    names = _ENUM_NAMES.get(enumclass)
+    if names is None:
+        names = {x.value: x.name for x in enumclass}
+        _ENUM_NAMES[enumclass] = names
     try:
-        return enumclass(val).name
-    except ValueError:
+        return names[val]
+    except KeyError:
         return "{}.<unknown {}>".format(enumclass.__name__, val)
 
 
@@ -294,3 +321,9 @@ SENSORS = {
     for x in BlueBerryLogEntryFields
     if x.value.is_configurable()
 }
+
+# SENSORS keys (apinames) in definition order
+SENSOR_NAMES = tuple(SENSORS)
+
+# all fields accepted by config write
+CONFIG_FIELDS = frozenset(SENSOR_NAMES) | {"logging", "interval"}
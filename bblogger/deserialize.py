@@ -1,12 +1,12 @@
 import logging
 import csv
 import json
+import os
 from platform import system
 
 from sys import stderr, stdout
 
-# not needed in python >= 3.6? as default dict keeps order
-from collections import OrderedDict, deque
+from collections import deque
 
 try:
     from google.protobuf.json_format import MessageToDict
@@ -19,6 +19,7 @@ except ImportError:
         tmpjs = MessageToJson(pb)
         return json.loads(tmpjs)
 from google.protobuf.message import DecodeError
+from google.protobuf.internal import api_implementation
 
 from bblogger import bb_log_entry_pb2
 from bblogger.defs import BlueBerryLogEntryFields
@@ -28,6 +29,19 @@ logger = logging.getLogger(__name__)
 
 TXT_COL_WIDTH = 10
 
+# pure python protobuf is more than 10 times slower parsing messages than the
+# C++ (cpp) or upb backends. protobuf >= 4.21 uses upb by default, so this is
+# only seen on old versions or if forced by the environment
+if api_implementation.Type() == "python":
+    logger.warning("Using slow pure python protobuf implementation. "
+                   "PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=%s",
+                   os.environ.get("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"))
+
+_LogEntry = bb_log_entry_pb2.bb_log_entry
+
+# end of log message only has the timestamp. any larger message can not be it
+_EOF_MSG_MAX_SIZE = len(_LogEntry(timestamp=0xFFFFFFFF).SerializeToString())
+
 
 _COLNAME_TO_FLD = {}
 _COLNAME_TO_UNITS = {}
@@ -43,36 +57,161 @@ for x in BlueBerryLogEntryFields:
         _COLNAME_TO_UNITS[colname] = fld.unit
         _COLNAME_TO_TXTFMT[colname]= fld.txtfmt
 
+# (pbname, is_repeated, colnames, colbit, scale, div) in descriptor
+# order. built once as the schema is fixed, instead of introspecting the
+# descriptor for every message. column i of a field sets bit colbit + i in the
+# present columns mask
+_PARSE_PLAN = []
+_ncols = 0
+for descr in _LogEntry.DESCRIPTOR.fields:
+    fld = _PBNAME_TO_FLD[descr.name]
+    is_repeated = descr.label == descr.LABEL_REPEATED
+    _PARSE_PLAN.append((descr.name, is_repeated, fld.colnames, _ncols,
+                        fld.scale, fld.div))
+    _ncols += len(fld.colnames)
+_PARSE_PLAN = tuple(_PARSE_PLAN)
+
+# present columns mask -> keys tuple. shared, the keys only depend on the mask
+_KEYS_BY_MASK = {}
+
+def _mask_to_keys(mask):
+    """ column names, in message order, of the columns present in mask """
+    keys = []
+    for _, _, colnames, colbit, _, _ in _PARSE_PLAN:
+        for i, colname in enumerate(colnames):
+            if mask & (1 << (colbit + i)):
+                keys.append(colname)
+    keys = tuple(keys)
+    _KEYS_BY_MASK[mask] = keys
+    return keys
+
+def _mk_extractor(raw):
+    """
+    generate a function returning the row (keys, vals) for a pb message
+    with the field accesses and unit conversions (raw * scale / div) of
+    _PARSE_PLAN unrolled. no descriptor walk, getattr by name or plan lookups
+    per message. keys is the same tuple object for every message with the same
+    mask of present columns.
+    assumption: all values can be converted to float or list of floats.
+    """
+    src = [
+        "def extract(pb):",
+        "    vals = []",
+        "    append = vals.append",
+        "    mask = 0",
+        # one method lookup per message, not per field
+        "    has = pb.HasField",
+    ]
+    for name, is_repeated, colnames, colbit, scale, div in _PARSE_PLAN:
+        conv = ""
+        if not raw and scale is not None:
+            # drop the no-op half, same result as x * 1.0 and x / 1.0 are
+            # exact for the integer fields
+            if scale != 1.0:
+                conv += " * {!r}".format(scale)
+            if div != 1.0:
+                conv += " / {!r}".format(div)
+            if not conv:
+                conv = " * 1.0"  # still a float
+
+        if is_repeated:
+            # HasField() do not work on repeated, use len instead.
+            # the repeated fields are non packed zigzag varints (proto2
+            # sint32) so there is no fixed width buffer to view as an array.
+            # a list comprehension over the 3 axis container is faster than
+            # map() based conversion.
+            src += [
+                "    val = pb.{}".format(name),
+                "    n = len(val)",
+                "    if n:",
+                "        mask |= ((1 << n) - 1) << {}".format(colbit),
+                "        vals.extend([v{} for v in val])".format(conv)
+                if conv else "        vals.extend(val)",
+            ]
+        else:
+            src += [
+                "    if has({!r}):".format(name),
+                "        mask |= {:#x}".format(1 << colbit),
+                "        append(pb.{}{})".format(name, conv),
+            ]
+    src += [
+        "    keys = _KEYS_BY_MASK.get(mask)",
+        "    if keys is None:",
+        "        keys = _mask_to_keys(mask)",
+        "    return keys, vals",
+    ]
+
+    namespace = {"_KEYS_BY_MASK": _KEYS_BY_MASK, "_mask_to_keys": _mask_to_keys}
+    exec("\n".join(src), namespace)
+    return namespace["extract"]
+
+_EXTRACT_UNITS = _mk_extractor(raw=False)
+_EXTRACT_RAW = _mk_extractor(raw=True)
 
 class _PacketBuffer:
     """
     FIFO buffer preserving BLE packets. can handle packets out of order and
     drop induvidual packets
-    'pkt' - bluteooth package (chunk of bytes)
+    'pkt' - bluteooth package (chunk of bytes). expected to be a memoryview
+    to allow zero-copy slicing
+
+    in order reads move a read offset (head) into the first pkt instead of
+    reslicing it. out of order reads (pkt_order given) apply the offset to the
+    first pkt first.
     """
 
     def __init__(self):
         self._q = deque(maxlen=128)
+        self._head = 0
+        self._nbytes = 0
+
+    def __len__(self):
+        """ number of buffered bytes """
+        return self._nbytes
+
+    def pkts(self):
+        """ list of the unread part of the buffered pkts """
+        self._apply_head()
+        return list(self._q)
+
+    def _apply_head(self):
+        if self._head:
+            self._q[0] = self._q[0][self._head:]
+            self._head = 0
 
     def write(self, data):
         if len(self._q) >= self._q.maxlen:
             raise RuntimeError("buf to small")
 
         self._q.append(data)
+        self._nbytes += len(data)
 
 
     def peek(self, size, pkt_order=None):
-        """ returns a bytearray of len size or less """
+        """ returns bytes (or memoryview) of len size or less """
 
-        res = bytearray()
-        if not size:
-            return res
+        if not size or not self._q:
+            return b""
 
+        # views of the parts, copied once by join into a bytes of the
+        # total size
+        parts = []
+        remains = size
         if pkt_order is None:
-            pkt_order = range(0, len(self._q))
+            head = self._head
+            first = self._q[0]
+            if len(first) - head >= size:
+                # all in first pkt, no need to copy
+                return first[head : head + size]
+
+            chunk = first[head:]
+            parts.append(chunk)
+            remains -= len(chunk)
+            pkt_order = range(1, len(self._q))
+        else:
+            self._apply_head()
 
         for i in pkt_order:
-            remains = size - len(res)
             if remains <= 0:
                 break
 
@@ -83,22 +222,29 @@ class _PacketBuffer:
 
             # remains could be out of range (no error raised)
             chunk = pkt[0 : remains]
-            res.extend(chunk)
+            parts.append(chunk)
+            remains -= len(chunk)
 
-        return res
+        return b"".join(parts)
 
 
     def getc(self):
         """ read a single char/byte """
+        q = self._q
+        while q:
+            pkt = q[0]
+            head = self._head
+            if head < len(pkt):
+                # an emptied pkt is kept until seek_fwd() or drop_pkt(). error
+                # recovery drops the pkt the msg size was read from
+                self._head = head + 1
+                self._nbytes -= 1
+                return int(pkt[head])
 
-        try:
-            c = self._q[0][0]
-        except IndexError:
-            raise EOFError()
-
-        self._q[0] = self._q[0][1:] # pop left
+            q.popleft() # empty pkt
+            self._head = 0
 
-        return int(c)
+        raise EOFError()
 
 
     def seek_fwd(self, size, pkt_order=None):
@@ -106,9 +252,28 @@ class _PacketBuffer:
         if not size:
             return
 
+        if size > self._nbytes:
+            raise EOFError()
+
         if pkt_order is None:
-            pkt_order = range(0, len(self._q))
+            # in order: consumed pkts are always at the front. pop them
+            # and move the head offset into the last one
+            q = self._q
+            remains = size
+            while remains:
+                avail = len(q[0]) - self._head
+                if remains < avail:
+                    self._head += remains
+                    self._nbytes -= remains
+                    return
+
+                q.popleft()
+                self._head = 0
+                self._nbytes -= avail
+                remains -= avail
+            return
 
+        self._apply_head()
         remains = size
         to_del = []
         for i in pkt_order:
@@ -120,6 +285,7 @@ class _PacketBuffer:
 
             if remains < len(pkt):
                 self._q[i] = pkt[remains:]
+                self._nbytes -= remains
                 remains = 0
                 break
 
@@ -134,11 +300,46 @@ class _PacketBuffer:
 
         # reverse sort to preserve index while deleting
         for i in sorted(to_del, reverse=True):
+            self._nbytes -= len(self._q[i])
             del self._q[i]
 
+    def take_frames(self):
+        """
+        remove and return the unread part of the only buffered pkt if it
+        starts with (at least two) complete <len><msg> frames. returns None,
+        and keeps the buffer as is, otherwise
+        """
+        q = self._q
+        while len(q) > 1 and self._head >= len(q[0]):
+            q.popleft() # empty pkt
+            self._head = 0
+
+        if len(q) != 1:
+            return None
+
+        pkt = q[0]
+        head = self._head
+        end = len(pkt)
+        if head >= end or end - head <= pkt[head]:
+            return None
+
+        # a single frame is as fast through getc(), peek() and seek_fwd()
+        # as handing over the pkt and writing back the incomplete rest
+        nxt = head + 1 + pkt[head]
+        if nxt >= end or end - nxt <= pkt[nxt]:
+            return None
+
+        q.popleft()
+        pkt = pkt[head:]
+        self._head = 0
+        self._nbytes = 0
+        return pkt
+
     def drop_pkt(self, n=0):
+        self._apply_head()
         r = self._q[n]
         del self._q[n]
+        self._nbytes -= len(r)
         return r
 
 class BlueBerryDeserializer:
@@ -149,19 +350,24 @@ class BlueBerryDeserializer:
     abbrevations and definitions used:
     'msg' - bytes or pb object for a complete message
     'pkg' - bluteooth package (chunk of bytes)
+
+    the last msg_hist_len messages are kept for the dump on parse errors.
+    msg_hist_len=0 keeps none.
     """
 
     def __init__(self, outfile=stdout, fmt="txt", raw=False, msg_hist_len=32):
-        self._pb = bb_log_entry_pb2.bb_log_entry()  # protobuf message
         self._raw = raw
-        self._msg_hist = deque(maxlen=msg_hist_len)
+        self._msg_hist = deque(maxlen=msg_hist_len) if msg_hist_len else None
         self._msg_count = 0
 
         self._pkt_buf = _PacketBuffer()
         self._msg_size = None
         self._fail_count = 0
         self._debug_dump = False
+        # pb message -> (keys, vals), converted to units if not raw
+        self._extract = _EXTRACT_RAW if raw else _EXTRACT_UNITS
 
+        self._no_output = outfile is None
         self._out = mk_OutputWriter(
                 outfile=outfile, 
                 fmt=fmt, 
@@ -169,97 +375,114 @@ class BlueBerryDeserializer:
                 units=_COLNAME_TO_UNITS,
                 formats=_COLNAME_TO_TXTFMT)
 
+    def close(self):
+        """ flush buffered output """
+        self._out.close()
+
     @property
     def nentries(self):
         return self._msg_count
 
-    def _MessageToOrderedDict(self, pb, columnize=False):
-        """ 
-        mimic name from protobuf lib.
-        assumption: all values can be converted to float or list of floats.
-        if the protobuf format change, the built in MessageToDict() function
-        can be used. requres python > 3.6 (?) where the default dict heaviour 
-        rememebers insertion order.
-        """
-        od = OrderedDict()
-        for descr in pb.DESCRIPTOR.fields:
-            fld = _PBNAME_TO_FLD[descr.name]
-            val = getattr(pb, descr.name)
-            if descr.label == descr.LABEL_REPEATED:
-                # HasField() do not work on repeated, use len instead. hack
-                if not len(val):
-                    continue
-
-                if columnize:
-                    for i in range(0, len(val)):
-                        name = fld.colnames[i]
-                        od[name] = val[i]
-                else:
-                    name = fld.colnames[0]
-                    od[name] = list(val)  # [x for x in val]
-            else:
-                if not pb.HasField(descr.name):
-                    continue
-                name = fld.colnames[0]
-                od[name] = val
-        return od
-
     def _print_msg_bytes(self, msg_count, msg_size, msg_bytes, err_str=""):
-        if isinstance(msg_bytes, (bytes, bytearray)):
+        if isinstance(msg_bytes, (bytes, bytearray, memoryview)):
             msg_bytes = msg_bytes.hex()
 
-        msg_count = "{:04x}".format(msg_count)
-        msg_size = "{:02x}".format(msg_size)
-        err_str = "'{}'".format(err_str)
-        print(msg_count, msg_size, msg_bytes, err_str, sep=",", file=stderr)
+        # one write per line. called per message in debug dump mode
+        stderr.write("{:04x},{:02x},{},'{}'\n".format(
+            msg_count, msg_size, msg_bytes, err_str))
 
-    def _dump_msg_hist(self, max_len=4):
+    def _dump_msg_hist(self):
+        """ cold path, only on parse failure. all hex and formatting of the
+        history entries is done here """
         print("==== MSG HISTORY DUMP (count, size, bytes, err) ====", file=stderr)
 
-        for entry in self._msg_hist:
-            msg_count, msg_size, msg_bytes, err_str = entry
-            self._print_msg_bytes(msg_count, msg_size, msg_bytes, err_str)
+        for msg_count, msg_bytes in self._msg_hist or ():
+            self._print_msg_bytes(msg_count, len(msg_bytes), msg_bytes)
 
-        msg_bytes = ','.join([ba.hex() for ba in self._pkt_buf._q])
+        msg_bytes = ','.join([ba.hex() for ba in self._pkt_buf.pkts()])
         msg_bytes = "({})".format(msg_bytes)
         err_str = "Failed pakets"
         self._print_msg_bytes(self._msg_count, self._msg_size, msg_bytes, err_str)
 
         print("==== END: MSG HISTORY ====", file=stderr)
 
-    def _is_end_of_log_msg(self, odm):
+    def _is_end_of_log_msg(self, keys):
         """ end of log "EOF" is a empty messagge with only the required
         timestamp field """
-        if len(odm) == 1:
-            if "TS" not in odm:
-                logger.warning("unexpected last msg keys {}".format(odm.keys()))
+        if len(keys) == 1:
+            if "TS" not in keys:
+                logger.warning("unexpected last msg keys {}".format(keys))
             return True
         else:
             return False
 
     def parse_msg_bytes(self, msg_bytes):
 
-        self._pb.Clear()
-        msg_bytes = bytes(msg_bytes)
-        # ignore E1101: Instance of 'bb_log_entry' has no 'FromString' member (no-member)
-        pb_msg = self._pb.FromString(msg_bytes) # pylint: disable=E1101
-        odmsg = self._MessageToOrderedDict(pb_msg, columnize=True)
-        done = self._is_end_of_log_msg(odmsg)
-        if done:
+        # FromString takes a memoryview (but not a bytearray) without copying
+        # ignore E1101: Class 'bb_log_entry' has no 'FromString' member (no-member)
+        pb_msg = _LogEntry.FromString(memoryview(msg_bytes)) # pylint: disable=E1101
+        if self._no_output and len(msg_bytes) > _EOF_MSG_MAX_SIZE:
+            # nothing to write and can't be the end of log. only count it
+            return False
+
+        keys, vals = self._extract(pb_msg)
+        if len(msg_bytes) <= _EOF_MSG_MAX_SIZE and self._is_end_of_log_msg(keys):
            logger.debug("End of log msg received")
-           return done
-        # convert to tuple as odict_keys object rejected by json module etc
-        keys = tuple(odmsg.keys())
-        if self._raw:
-            vals = tuple(odmsg.values())
-        else:
-            vals = [_COLNAME_TO_FLD[k].tounit(v) for k, v in odmsg.items()]
+           return True
 
         assert len(keys) == len(vals)
         self._out.write_sensordata(keys, vals)
 
+        return False
+
+    def _handle_msg(self, msg_size, msg_bytes):
+        """ parse (or dump) one complete message and keep it in history """
+        if self._debug_dump:
+            self._print_msg_bytes(self._msg_count, msg_size, msg_bytes)
+            done = False
+        else:
+            done = self.parse_msg_bytes(msg_bytes)
+
+        if self._msg_hist is not None:
+            # (count, msg_bytes). msg_bytes is a view or the peeked copy, not
+            # copied again. size and hex are only made if dumped
+            self._msg_hist.append((self._msg_count, msg_bytes))
+        self._msg_count += 1
+
         return done
 
+    def _parse_frames(self, chunk):
+        """ 
+        parse the complete <len><msg> frames at the start of chunk in place,
+        without going through pkt_buf. stops at the first incomplete or
+        invalid frame, which is left to the buffered path (incl. recovery).
+        returns the unparsed remains of chunk and done
+        """
+        # this loop runs per message, keep lookups out of it
+        handle_msg = self._handle_msg
+        pos = 0
+        end = len(chunk)
+        while pos < end:
+            msg_size = chunk[pos]
+            nxt = pos + 1 + msg_size
+            if not msg_size or nxt > end:
+                break
+
+            try:
+                done = handle_msg(msg_size, chunk[pos + 1 : nxt])
+            except DecodeError:
+                break
+
+            if pos == 0 and self._fail_count:
+                self._fail_count = 0
+                logger.debug("Successfully recovered")
+
+            pos = nxt
+            if done:
+                return chunk[pos:], True
+
+        return chunk[pos:], False
+
     def _parse_pkt_buf(self, pkt_order=None):
         """ parse data previously added to pkt_buf """
         if self._msg_size is None:
@@ -272,15 +495,7 @@ class BlueBerryDeserializer:
         if len(msg_bytes) < self._msg_size:
             raise EOFError("Need more data")
 
-        if self._debug_dump:
-            self._print_msg_bytes(self._msg_count, self._msg_size, msg_bytes)
-            done = False
-        else:
-            done = self.parse_msg_bytes(msg_bytes)
-
-        entry = (self._msg_count, self._msg_size, msg_bytes, "")
-        self._msg_hist.append(entry)
-        self._msg_count += 1
+        done = self._handle_msg(self._msg_size, msg_bytes)
 
         # reset
         self._pkt_buf.seek_fwd(self._msg_size, pkt_order)
@@ -289,12 +504,40 @@ class BlueBerryDeserializer:
         return done # might have more msg in pkt_buf
 
     def putb(self, chunk):
-        if not isinstance(chunk, bytearray):
-            chunk = bytearray(chunk)
+        # buffer packets as memoryviews so the slicing done while consuming
+        # them (getc, seek_fwd) doesn't copy the remaining bytes each time
+        if not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        chunk = memoryview(chunk)
+
+        if self._msg_size is None and not len(self._pkt_buf):
+            # nothing buffered, i.e. chunk starts with a msg size byte
+            chunk, done = self._parse_frames(chunk)
+            if done:
+                return True
+            if not chunk:
+                return False
 
         self._pkt_buf.write(chunk)
 
         while True:
+            # only decode when a complete message (or its size byte) is
+            # buffered. most BLE packets only carry part of a message.
+            if len(self._pkt_buf) < (self._msg_size or 1):
+                return False  # Need more data
+
+            if self._msg_size is None:
+                # a message split over pkts is done. the frames after it in
+                # the same pkt are parsed in place as for a new chunk
+                rest = self._pkt_buf.take_frames()
+                if rest is not None:
+                    rest, done = self._parse_frames(rest)
+                    if done:
+                        return True
+                    if not rest:
+                        return False
+                    # incomplete or invalid frame
+                    self._pkt_buf.write(rest)
 
             try:
                 done = self._parse_pkt_buf()
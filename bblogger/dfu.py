@@ -1,17 +1,17 @@
 import asyncio
 import logging
 import time
+from functools import total_ordering
 from sys import platform
-from os.path import join as path_join
-from os.path import getsize, realpath
-from shutil import rmtree
-from tempfile import mkdtemp
-from binascii import crc32
+from os.path import realpath
+from zipfile import ZipFile
+from zlib import crc32  # unsigned, no & 0xFFFFFFFF needed
 from uuid import UUID
 from random import randint
 
 # Nordic libraries
 from nordicsemi.dfu.package import Package
+from nordicsemi.dfu.manifest import Manifest
 
 from nordicsemi.dfu.dfu_transport import (
     OP_CODE,
@@ -25,7 +25,7 @@ from nordicsemi.dfu.dfu_transport import (
     NordicSemiException,
 )
 
-from bleak import BleakClient, discover
+from bleak import BleakClient, BleakScanner, discover
 from bleak.exc import BleakError
 
 logger = logging.getLogger(__name__)
@@ -34,7 +34,15 @@ logger = logging.getLogger(__name__)
 class _UUIDWithStrCmp(UUID):
     """ Same as UUID but compares to string (not case sensitive) """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # UUID blocks setattr. str(self) is the lowercase canonical form
+        object.__setattr__(self, "_str", str(self))
+
     def __cmp__(self, other):
+        # common case, skip the isinstance chain
+        if other.__class__ is _UUIDWithStrCmp:
+            return self.int - other.int
 
         if not isinstance(other, UUID):
 
@@ -47,17 +55,21 @@ class _UUIDWithStrCmp(UUID):
             try:
                 other = UUID(other)
             except Exception as e:
-                logger.debug("{} != {}".format(self, other))
+                logger.debug("%s != %s", self, other)
                 return -1
 
         return self.int - other.int
 
+    # not functools.total_ordering, UUID already has all the rich comparisons
+    # and they do not compare to str. __ne__ is the inverse of __eq__
     def __eq__(self, other):
+        if isinstance(other, UUID):
+            return self.int == other.int
+        if isinstance(other, str) and other.lower() == self._str:
+            # no parsing for the common "uuid in advertised uuids" match
+            return True
         return self.__cmp__(other) == 0
 
-    def __ne__(self, other):
-        return self.__cmp__(other) != 0
-
     def __gt__(self, other):
         return self.__cmp__(other) > 0
 
@@ -105,6 +117,11 @@ class BLE_UUID:
     # fmt: on
 
 
+# separators removed when parsing a BLE address string
+_ADDR_SEPS = str.maketrans("", "", ":-")
+
+
+@total_ordering
 class BleAddress:
     """
     NRF "unbounded buttonless" DFU increments the BLE app address with one.
@@ -118,10 +135,7 @@ class BleAddress:
         elif isinstance(x, int):
             self._int = x
         else:
-            s = x
-            s = s.replace(":", "")
-            s = s.replace("-", "")
-            ba = bytes.fromhex(s)
+            ba = bytes.fromhex(x.translate(_ADDR_SEPS))
             if len(ba) != 6:
                 raise ValueError("Invalid BLE address string")
 
@@ -132,11 +146,12 @@ class BleAddress:
             self._int = (self._int + n) & 0xFFFFFFFFFFFF
 
     def __str__(self):
-        # return ba.hex(":") # only works in python >= 3.8
-        ba = int.to_bytes(self._int, length=6, byteorder="big")
-        return ":".join("{:02x}".format(x) for x in ba)
+        return int.to_bytes(self._int, length=6, byteorder="big").hex(":")
 
     def __cmp__(self, other):
+        if other.__class__ is BleAddress:
+            return self._int - other._int
+
         if not isinstance(other, BleAddress):
             try:
                 other = BleAddress(other)
@@ -147,27 +162,15 @@ class BleAddress:
         return self._int - other._int
 
     def __hash__(self):
-        """ needed to have class hashable """
-        return id(self)
+        """ equal addresses hash equal, i.e. usable as dict keys """
+        return hash(self._int)
 
     def __eq__(self, other):
         return self.__cmp__(other) == 0
 
-    def __ne__(self, other):
-        return self.__cmp__(other) != 0
-
-    def __gt__(self, other):
-        return self.__cmp__(other) > 0
-
     def __lt__(self, other):
         return self.__cmp__(other) < 0
 
-    def __ge__(self, other):
-        return self.__cmp__(other) >= 0
-
-    def __le__(self, other):
-        return self.__cmp__(other) <= 0
-
     def dfu_addr(self):
         return BleAddress(self._int, n=1)
 
@@ -182,23 +185,10 @@ def app_addr_to_dfu_addr(app_addr):
     return dfu_addr
 
 
-class _ATimeoutEvent(asyncio.Event):
-    """ 
-    Same as asyncio.Event but wait has a timeout option like threading.Event 
-    """
-
-    async def wait(self, timeout=None):
-        """ return True on success, False on timeout """
-        if timeout is None:
-            await super().wait()
-            return True
-
-        try:
-            await asyncio.wait_for(super().wait(), timeout)
-        except asyncio.TimeoutError:
-            return False
-
-        return True
+def _crc32_of(data, start, end, crc=0):
+    """ crc32 of data[start:end], continued from crc. no copy of the slice """
+    with memoryview(data) as mv, mv[start:end] as part:
+        return crc32(part, crc)
 
 
 class _ATimeoutQueue(asyncio.Queue):
@@ -216,18 +206,18 @@ class _ATimeoutQueue(asyncio.Queue):
 
 
 class DfuImage:
-    """ Paths to a binary(firmware) file with init_packet """
+    """ Binary (firmware) and init_packet bytes read from the zip """
 
-    def __init__(self, unpacked_zip, firmware):
-        self.init_packet = path_join(unpacked_zip, firmware.dat_file)
-        self.bin_file = path_join(unpacked_zip, firmware.bin_file)
+    def __init__(self, zf, firmware):
+        self.init_packet = zf.read(firmware.dat_file)
+        self.firmware = zf.read(firmware.bin_file)
 
 
 class DfuImagePkg:
     # TODO this class not needed!? either add this to class Manifest
     # or extend it like `ManifestWithPaths(Manifest)`
     """ Class to abstract the DFU zip Package structure and only expose
-    init_packet and binary file paths. """
+    init_packet and binary (firmware) data. """
 
     def __init__(self, zip_file_path):
         """
@@ -236,42 +226,35 @@ class DfuImagePkg:
         zip_file_path = realpath(zip_file_path)
         print(zip_file_path)
 
-        self.temp_dir = mkdtemp(prefix="nrf_dfu_")
-        self.unpacked_zip = path_join(self.temp_dir, "unpacked_zip")
-        self.manifest = Package.unpack_package(zip_file_path, self.unpacked_zip)
-
-        self.images = {}
-
-        if self.manifest.softdevice_bootloader:
-            k = "softdevice_bootloader"
-            self.images[k] = DfuImage(
-                self.unpacked_zip, self.manifest.softdevice_bootloader
+        # read in memory, no unpacking to a temp dir. the files are small and
+        # all read whole anyway
+        with ZipFile(zip_file_path, "r") as zf:
+            self.manifest = Manifest.from_json(
+                zf.read(Package.MANIFEST_FILENAME).decode()
             )
 
-        if self.manifest.softdevice:
-            k = "softdevice"
-            self.images[k] = DfuImage(self.unpacked_zip, self.manifest.softdevice)
+            self.images = {}
 
-        if self.manifest.bootloader:
-            k = "bootloader"
-            self.images[k] = DfuImage(self.unpacked_zip, self.manifest.bootloader)
+            if self.manifest.softdevice_bootloader:
+                k = "softdevice_bootloader"
+                self.images[k] = DfuImage(zf, self.manifest.softdevice_bootloader)
 
-        if self.manifest.application:
-            k = "application"
-            self.images[k] = DfuImage(self.unpacked_zip, self.manifest.application)
+            if self.manifest.softdevice:
+                k = "softdevice"
+                self.images[k] = DfuImage(zf, self.manifest.softdevice)
 
-    def __del__(self):
-        """
-        Destructor removes the temporary directory for the unpacked zip
-        :return:
-        """
-        logger.debug("Removing {}".format(self.temp_dir))
-        rmtree(self.temp_dir)
+            if self.manifest.bootloader:
+                k = "bootloader"
+                self.images[k] = DfuImage(zf, self.manifest.bootloader)
+
+            if self.manifest.application:
+                k = "application"
+                self.images[k] = DfuImage(zf, self.manifest.application)
 
     def get_total_size(self):
         total_size = 0
         for name, image in self.images.items():
-            total_size += getsize(image.bin_file)
+            total_size += len(image.firmware)
         return total_size
 
 
@@ -286,27 +269,55 @@ class DfuDevice:
             raise ValueError("invalid address")
 
         timeout = kwargs.get("timeout", 10)
-        self._bleclnt = BleakClient(self.address, timeout=timeout)
+        # BLEDevice from a previous scan saves bleak a discovery on connect
+        device = kwargs.get("device")
+        self._bleclnt = BleakClient(device or self.address, timeout=timeout)
 
-        # TODO what packet_size? 20 seems small --> slow
         # packet size ATT_MTU_DEFAULT - 3
         # ATT_MTU_DEFAULT = driver.GATT_MTU_SIZE_DEFAULT
         # #define GATT_MTU_SIZE_DEFAULT 23
+        # increased to negotiated MTU - 3 on connect. `mtu` overrides it
         self.packet_size = 20
+        self._mtu = kwargs.get("mtu")
 
-        self._cp_notif_evt = asyncio.Event()
-        self._cp_notif_data = []
+        # control point notifications. subscribed once on connect
+        self._cp_notif_queue = _ATimeoutQueue()
 
-        self.prn = 0  # TODO prn not yet supported
+        # packet receipt notification. the device notifies the CRC every prn
+        # data packets (0 disables), checked while streaming the object
+        self.prn = kwargs.get("prn", 16)
         self.RETRIES_NUMBER = 3
 
     async def connect(self):
         logger.debug("Connecting {}...".format(self.address))
         await self._bleclnt.connect()
+        await self._exchange_mtu()
         await self._bleclnt.start_notify(
             BLE_UUID.C_DFU_CONTROL_POINT, self._on_cp_notif
         )
 
+    async def _exchange_mtu(self):
+        """ request a larger ATT MTU and use it for the packet size. fewer
+        data point writes per object. only BlueZ needs the request, other
+        backends negotiate MTU on connect """
+        mtu = self._mtu
+        if mtu is None:
+            acquire_mtu = getattr(
+                getattr(self._bleclnt, "_backend", None), "_acquire_mtu", None
+            )
+            if acquire_mtu is not None:
+                try:
+                    await acquire_mtu()
+                except Exception as e:
+                    logger.debug("MTU exchange failed: {}".format(e))
+
+            mtu = getattr(self._bleclnt, "mtu_size", None)
+
+        if mtu:
+            self.packet_size = max(20, mtu - 3)
+
+        logger.info("MTU size {}, packet size {}".format(mtu, self.packet_size))
+
     async def disconnect(self):
         logger.debug("Disconnecting {} ...".format(self.address))
         await self._bleclnt.disconnect()
@@ -319,9 +330,7 @@ class DfuDevice:
         await self.disconnect()
 
     def _on_cp_notif(self, sender, data):
-        cpuuid = BLE_UUID.C_DFU_CONTROL_POINT
-        self._cp_notif_data.append(data)
-        self._cp_notif_evt.set()
+        self._cp_notif_queue.put_nowait(data)
 
     async def cp_cmd(self, opcode, **kwargs):
         return await asyncio.wait_for(self.__cp_cmd(opcode, **kwargs), timeout=20)
@@ -332,36 +341,50 @@ class DfuDevice:
         parses response and check success.
         returns payload (if any).
 
-        assumes payload fits in a single transfer/packet.
+        assumes payload fits in a single transfer/packet. each notification
+        is queued whole, i.e. one complete response.
 
         note: enable and disable control point notifications for every command/operation do not work.
         unclear why - have not investigated it.
         """
         cpuuid = BLE_UUID.C_DFU_CONTROL_POINT
+        # bytes are written as is. (the txdbus backend of bleak < 0.10 needed
+        # a bytearray)
         txdata = operation_txd_pack(opcode, **kwargs)
-        if not isinstance(txdata, bytearray):
-            # bytes object not supported in txdbus
-            txdata = bytearray(txdata)
 
-        if len(self._cp_notif_data):
+        if not self._cp_notif_queue.empty():
             logger.warning("Unread control point notifications")
-            self._cp_notif_data = []
+            while not self._cp_notif_queue.empty():
+                self._cp_notif_queue.get_nowait()
 
-        self._cp_notif_evt.clear()
-        logger.debug("cmd {} TXD:{}".format(opcode, txdata))
+        logger.debug("cmd %s TXD:%s", opcode, txdata)
         await self._bleclnt.write_gatt_char(cpuuid, txdata, response=True)
 
         try:
-            await asyncio.wait_for(self._cp_notif_evt.wait(), timeout=10)
+            rxdata = await self._cp_notif_queue.get(timeout=10)
         except asyncio.TimeoutError:
             raise OperationResponseTimeoutError("CP Operation {}".format(opcode))
 
-        rxdata = self._cp_notif_data.pop(0)  # pop first element
-        logger.debug("cmd {} RXD:{}".format(opcode, rxdata))
+        logger.debug("cmd %s RXD:%s", opcode, rxdata)
         return operation_rxd_unpack(opcode, rxdata)
 
     async def _validate_crc(self, crc, offset):
         response = await self.cp_cmd(OP_CODE.CRC_GET)
+        self._check_crc(response, crc, offset)
+
+    async def _validate_prn_crc(self, crc, offset):
+        """ check the CRC notification sent every prn data packets """
+        try:
+            rxdata = await self._cp_notif_queue.get(timeout=10)
+        except asyncio.TimeoutError:
+            raise OperationResponseTimeoutError("PRN at offset {}".format(offset))
+
+        # same format as the CRC_GET response
+        response = operation_rxd_unpack(OP_CODE.CRC_GET, rxdata)
+        self._check_crc(response, crc, offset)
+
+    @staticmethod
+    def _check_crc(response, crc, offset):
         if crc != response["crc"]:
             raise ValidationException(
                 "Failed CRC validation.\n"
@@ -373,9 +396,10 @@ class DfuDevice:
                 + "Expected: {} Received: {}.".format(offset, response["offset"])
             )
 
-    async def __stream_data(self, data, crc=0, offset=0):
+    async def __stream_data(self, data, crc=0, offset=0, packet_size=None):
         """ write to package data characteristic (aka DP_UUID or data_point) in
-        chunks and verify success"""
+        chunks of packet_size (default self.packet_size) and verify success"""
+        packet_size = packet_size or self.packet_size
         logger.debug(
             "BLE: Streaming Data: len:{0} offset:{1} crc:0x{2:08X}".format(
                 len(data), offset, crc
@@ -383,17 +407,20 @@ class DfuDevice:
         )
 
         current_pnr = 0
-        for i in range(0, len(data), self.packet_size):
-            packet = data[i : i + self.packet_size]
+        for i in range(0, len(data), packet_size):
+            packet = data[i : i + packet_size]
+            # write without response (as nrfutil). no round trip per packet,
+            # the data is verified with the CRC of the object
             await self._bleclnt.write_gatt_char(
-                BLE_UUID.C_DFU_PACKET_DATA, packet, response=True
+                BLE_UUID.C_DFU_PACKET_DATA, packet, response=False
             )
-            crc = crc32(packet, crc) & 0xFFFFFFFF
+            crc = crc32(packet, crc)
             offset += len(packet)
             current_pnr += 1
             if self.prn == current_pnr:
                 current_pnr = 0
-                # TODO read CRC from CONTROL_POINT notifications
+                # fail early, not after the whole object
+                await self._validate_prn_crc(crc, offset)
 
         await self._validate_crc(crc, offset)
 
@@ -405,7 +432,7 @@ class DfuDevice:
                 # There is no init packet or present init packet is too long.
                 return False
 
-            expected_crc = crc32(init_packet[: response["offset"]]) & 0xFFFFFFFF
+            expected_crc = _crc32_of(init_packet, 0, response["offset"])
 
             if expected_crc != response["crc"]:
                 # Present init packet is invalid.
@@ -418,6 +445,7 @@ class DfuDevice:
                         data=init_packet[response["offset"] :],
                         crc=expected_crc,
                         offset=response["offset"],
+                        packet_size=packet_size,
                     )
                 except ValidationException:
                     return False
@@ -426,6 +454,8 @@ class DfuDevice:
             return True
 
         response = await self.cp_cmd(OP_CODE.OBJ_SELECT, obj_type=OBJ_TYPE.COMMAND)
+        # a packet never spans objects
+        packet_size = min(self.packet_size, response["max_size"])
         if len(init_packet) > response["max_size"]:
             raise Exception("Init command is too long")
 
@@ -440,11 +470,12 @@ class DfuDevice:
                     obj_type=OBJ_TYPE.COMMAND,
                     size=len(init_packet),
                 )
-                await self.__stream_data(data=init_packet)
+                await self.__stream_data(data=init_packet, packet_size=packet_size)
                 # was: self.__execute()
                 await self.cp_cmd(OP_CODE.OBJ_EXECUTE)
             except ValidationException:
                 logger.debug("attempt failed")
+                continue
             break
         else:
             raise NordicSemiException("Failed to send init packet")
@@ -455,15 +486,22 @@ class DfuDevice:
                 # Nothing to recover
                 return
 
-            expected_crc = crc32(firmware[: response["offset"]]) & 0xFFFFFFFF
             remainder = response["offset"] % response["max_size"]
+            # start of the last (maybe partial) object. the crc up to it is
+            # needed if that object is corrupted, and continued to offset
+            # otherwise. one pass over the prefix for both
+            obj_offset = response["offset"] - (
+                remainder if remainder != 0 else response["max_size"]
+            )
+            obj_crc = _crc32_of(firmware, 0, obj_offset)
+            expected_crc = _crc32_of(
+                firmware, obj_offset, response["offset"], obj_crc
+            )
 
             if expected_crc != response["crc"]:
                 # Invalid CRC. Remove corrupted data.
-                response["offset"] -= (
-                    remainder if remainder != 0 else response["max_size"]
-                )
-                response["crc"] = crc32(firmware[: response["offset"]]) & 0xFFFFFFFF
+                response["offset"] = obj_offset
+                response["crc"] = obj_crc
                 return
 
             if (remainder != 0) and (response["offset"] != len(firmware)):
@@ -475,19 +513,24 @@ class DfuDevice:
                         - remainder
                     ]
                     response["crc"] = await self.__stream_data(
-                        data=to_send, crc=response["crc"], offset=response["offset"]
+                        data=to_send,
+                        crc=response["crc"],
+                        offset=response["offset"],
+                        packet_size=packet_size,
                     )
                     response["offset"] += len(to_send)
                 except ValidationException:
                     # Remove corrupted data.
-                    response["offset"] -= remainder
-                    response["crc"] = crc32(firmware[: response["offset"]]) & 0xFFFFFFFF
+                    response["offset"] = obj_offset
+                    response["crc"] = obj_crc
                     return
 
             await self.cp_cmd(OP_CODE.OBJ_EXECUTE)
             logger.info("progress at {}".format(response["offset"]))
 
         response = await self.cp_cmd(OP_CODE.OBJ_SELECT, obj_type=OBJ_TYPE.DATA)
+        # a packet never spans objects
+        packet_size = min(self.packet_size, response["max_size"])
         await try_to_recover()
 
         for i in range(response["offset"], len(firmware), response["max_size"]):
@@ -498,11 +541,12 @@ class DfuDevice:
                         OP_CODE.OBJ_CREATE, obj_type=OBJ_TYPE.DATA, size=len(data)
                     )
                     response["crc"] = await self.__stream_data(
-                        data=data, crc=response["crc"], offset=i
+                        data=data, crc=response["crc"], offset=i, packet_size=packet_size
                     )
                     await self.cp_cmd(OP_CODE.OBJ_EXECUTE)
                 except ValidationException:
-                    pass
+                    logger.debug("attempt failed")
+                    continue
                 break
             else:
                 raise NordicSemiException("Failed to send firmware")
@@ -514,16 +558,14 @@ class DfuDevice:
         """
         for name, image in imgpkg.images.items():
             start_time = time.time()
+            # before any object of the image is written, incl. recovery
+            await self.cp_cmd(OP_CODE.PRN_SET, prn=self.prn)
 
             logger.info("Sending init packet for {} ...".format(name))
-            with open(image.init_packet, "rb") as f:
-                data = f.read()
-                await self.send_init_packet(data)
+            await self.send_init_packet(image.init_packet)
 
             logger.info("Sending firmware bin file for {}...".format(name))
-            with open(image.bin_file, "rb") as f:
-                data = f.read()
-                await self.send_firmware(data)
+            await self.send_firmware(image.firmware)
 
             end_time = time.time()
             delta_time = end_time - start_time
@@ -552,44 +594,77 @@ def is_dfu_device(dev):
         if "uuids" not in dev.metadata:
             return 0
 
-        advertised = dev.metadata["uuids"] # service uuids
-        # logger.debug(str(BLE_UUID.S_NORDIC_SEMICONDUCTOR_ASA) + " in " + str(advertised))
-        if BLE_UUID.S_NORDIC_SEMICONDUCTOR_ASA in advertised:
+        advertised = _uuid_strs(dev.metadata["uuids"]) # service uuids
+        if _NORDIC_ASA_STR in advertised:
             return 2
-        elif BLE_UUID.C_DFU_BUTTONLESS_BONDED in advertised:
+        elif _DFU_BONDED_STR in advertised:
             return 3
-        elif BLE_UUID.C_DFU_BUTTONLESS_UNBONDED in advertised:
+        elif _DFU_UNBONDED_STR in advertised:
             return 4
 
         return 0
 
+# lowercase uuid strings, looked up in the set of advertised service uuids
+_NORDIC_ASA_STR = str(BLE_UUID.S_NORDIC_SEMICONDUCTOR_ASA)
+_DFU_BONDED_STR = str(BLE_UUID.C_DFU_BUTTONLESS_BONDED)
+_DFU_UNBONDED_STR = str(BLE_UUID.C_DFU_BUTTONLESS_UNBONDED)
+
+def _uuid_strs(advertised):
+    """ set of lowercase str of the advertised uuids """
+    return {str(u).lower() for u in advertised}
+
+def _dfu_match(advertised):
+    """ why a device advertising the service uuids is seen as DFU or None """
+    advertised = _uuid_strs(advertised)
+    if _NORDIC_ASA_STR in advertised:
+        return "nordic semi asa"
+    elif _DFU_BONDED_STR in advertised:
+        return "DFU bonded"
+    elif _DFU_UNBONDED_STR in advertised:
+        return "DFU unbonded"
+    return None
+
+
 async def scan_dfu_devices(app_address=None, timeout=10):
-    """ Scan (discover) devices already in bootloader """
-    devices = []
-    candidates = await discover(timeout=timeout)
-    for d in candidates:
-        match = None
-        if "uuids" in d.metadata:
-            advertised = d.metadata["uuids"]  # service uuids
-            # logger.debug(str(BLE_UUID.S_NORDIC_SEMICONDUCTOR_ASA) + " in " + str(advertised))
-            if BLE_UUID.S_NORDIC_SEMICONDUCTOR_ASA in advertised:
-                match = "nordic semi asa"
-            elif BLE_UUID.C_DFU_BUTTONLESS_BONDED in advertised:
-                match = "DFU bonded"
-            elif BLE_UUID.C_DFU_BUTTONLESS_UNBONDED in advertised:
-                match = "DFU unbonded"
-
-        if match:
-            logger.info(
-                "dfu device: {}  rssi:{} dBm  name:{} ({})".format(
-                    d.address, d.rssi, d.name, match
-                )
+    """ Scan (discover) devices already in bootloader. if app_address given,
+    stop as soon as its DFU address is found """
+    devices = {}
+    found = asyncio.Event()
+    dfu_addr = None
+    if app_address and platform != "darwin":
+        # MacOS has device UUIDs, not addresses. see app_to_dfu_address
+        dfu_addr = BleAddress(app_address).dfu_addr()
+
+    def on_detect(d, advertisement_data):
+        if d.address in devices:
+            devices[d.address] = d  # latest rssi
+            return
+
+        match = _dfu_match(advertisement_data.service_uuids)
+        if not match:
+            logger.debug("ignoring device=%s", d)
+            return
+
+        logger.info(
+            "dfu device: {}  rssi:{} dBm  name:{} ({})".format(
+                d.address, d.rssi, d.name, match
             )
-            devices.append(d)
-        else:
-            logger.debug("ignoring device={}".format(d))
+        )
+        devices[d.address] = d
+
+        if dfu_addr is not None and dfu_addr == d.address:
+            found.set()
+
+    scanner = BleakScanner(on_detect)
+    await scanner.start()
+    try:
+        await asyncio.wait_for(found.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await scanner.stop()
 
-    return devices
+    return list(devices.values())
 
 
 if platform == "darwin":
@@ -657,7 +732,7 @@ if platform == "darwin":
             if advertised and BLE_UUID.S_NORDIC_SEMICONDUCTOR_ASA in advertised:
                 candidates.append(dev_info)
             else:
-                logger.debug("ignoring device {}".format(dev_info))
+                logger.debug("ignoring device %s", dev_info)
 
         if not candidates:
             raise RuntimeError("Failed to find any devices in DFU mode")
@@ -666,7 +741,7 @@ if platform == "darwin":
         for dev_info in candidates:
             # send a ping to candidate. this should make MacOS write the MAC address to plist
             try:
-                async with DfuDevice(address=dev_info.address) as dev:
+                async with DfuDevice(address=dev_info.address, device=dev_info) as dev:
                     success = await dev._ping()
                     logger.debug(
                         "DFU ping to {} - {}".format(
@@ -1,19 +1,57 @@
 import csv
 import json
+import re
 import sys
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# rows written per outfile.write() call when not writing to a terminal
+BATCH_SIZE = 256
+
+class _RowBatch:
+    """ file like object collecting rows, written to outfile in one call per
+    batch_size rows """
+    def __init__(self, outfile, batch_size):
+        self._outfile = outfile
+        self._batch_size = batch_size
+        self._rows = []
+
+    def write(self, s):
+        self._rows.append(s)
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._outfile.write("".join(self._rows))
+            self._rows.clear()
+
+
 class OutputWriterBase:
-    def __init__(self, outfile, header=None, units={}, **kwargs):
+    def __init__(self, outfile, header=None, units={}, batch_size=None, **kwargs):
+        if batch_size is None:
+            # keep terminal output live, one row per write
+            isatty = getattr(outfile, "isatty", None)
+            batch_size = 1 if isatty and isatty() else BATCH_SIZE
+
         self._outfile = outfile
+        self._batch = _RowBatch(outfile, batch_size)
         self._header = header
         self._units = units
         if header:
             self.write_row(header)
 
-        self._prev_keyset = None
+        self._prev_keys = None
+
+    def flush(self):
+        """ write buffered rows to outfile """
+        self._batch.flush()
 
     def close(self):
-        pass
+        self.flush()
 
     def write_row(self, vals):
         pass
@@ -24,24 +62,27 @@ class OutputWriterBase:
     def _did_keys_change(self, keys):
         """ 
         compare keys/field names from previous message and check if changed.
+        the deserializer passes the same keys tuple object for messages with
+        the same fields, so this is an identity check for most rows.
         side effect: new keys stored
         """
-
-        keyset = set(keys)
-        if self._prev_keyset != keyset:
-            if self._prev_keyset is not None:
-                add_header = 1
-            else:
-                add_header = 2
-            self._prev_keyset = keyset
+        prev_keys = self._prev_keys
+        if keys is prev_keys:
+            return 0
+        self._prev_keys = keys
+
+        if prev_keys is None:
+            return 2
+        elif tuple(prev_keys) != tuple(keys):
+            return 1
         else:
-            add_header = 0
-
-        return add_header
+            return 0
 
 
     def write_sensordata(self, keys, vals):
-        if self._did_keys_change(keys):
+        # same keys object as the previous row is the common case, checked
+        # inline to not make a call per row
+        if keys is not self._prev_keys and self._did_keys_change(keys):
             self.write_row(keys)
         self.write_row(vals)
 
@@ -51,6 +92,25 @@ class OutputWriterBase:
         else:
             return self._units[k]
 
+# txt format "{0: W.Pf}". shortest output is sign, digit and P decimals
+_FIXED_FMT = re.compile(r"^\{0: (\d+)\.(\d+)f\}$")
+
+def _txt_col_field(fmt, width):
+    """
+    replacement field for a value formatted with fmt and left justified to
+    width. returns (field, pre) where pre is a func to apply to the value
+    first when it can not be done in one field.
+    """
+    m = _FIXED_FMT.match(fmt) if fmt else None
+    if m:
+        w, p = int(m.group(1)), int(m.group(2))
+        if w <= 2 + (p + 1 if p else 0):
+            # the inner width never pads, justify and format in one go
+            return "{{:< {}.{}f}}".format(width, p), None
+
+    return "{{:<{}}}".format(width), fmt.format if fmt else str
+
+
 class OutputWriterTxt(OutputWriterBase):
     def __init__(self, outfile, header=None, colwidth=None, colwidths=[], formats={}, **kwargs):
         if colwidth and colwidths:
@@ -59,54 +119,97 @@ class OutputWriterTxt(OutputWriterBase):
         self._colwidth = colwidth
         self._colwidths = colwidths
         self._formats = formats
+        self._row_fmt = None
+        self._col_pres = ()
+        self._row_buf = []
+        # keys -> _mk_layout(keys)
+        self._layouts = {}
+        # ncols -> _row_template(ncols)
+        self._row_templates = {}
 
         super().__init__(outfile, header, **kwargs)
 
-    def _col_pad(self, i, s):
-        """ colum space padding """
-        s = str(s)
+    def _col_width(self, i):
         if self._colwidth:
-            n = self._colwidth
+            return self._colwidth
         elif i < len(self._colwidths):
-            n = self._colwidths[i]
+            return self._colwidths[i]
         else:
-            n = 1
+            return 1
 
-        return s.ljust(n)
+    def _row_template(self, ncols):
+        """ format string padding ncols str values to their column width """
+        tmpl = self._row_templates.get(ncols)
+        if tmpl is None:
+            fields = ["{{:<{}}}".format(self._col_width(i)) for i in range(ncols)]
+            tmpl = " ".join(fields) + "\n"
+            self._row_templates[ncols] = tmpl
+        return tmpl
 
     def write_row(self, vals):
-        a = [self._col_pad(i, v) for i, v in enumerate(vals)]
-        print(*a, sep=" ", file=self._outfile)
+        self._batch.write(self._row_template(len(vals)).format(*map(str, vals)))
 
     def write_kv(self, d):
         klen = max(len(str(k)) for k in d) + 1
-        for k, v in d.items():
-            ks = "{}:".format(k).ljust(klen)
-            vs = str(v)
-            print("   ", ks, vs, file=self._outfile)
-
+        # single write instead of one print per key
+        lines = [
+            "    {} {}\n".format("{}:".format(k).ljust(klen), v)
+            for k, v in d.items()
+        ]
+        self._batch.write("".join(lines))
+        self.flush()
+
+
+    def _mk_layout(self, keys):
+        """ (header, row_fmt, col_pres, row_buf) for sensor data with keys """
+        units = ["({})".format(self.get_unit(k)) for k in keys]
+        tmpl = self._row_template(len(keys))
+        header = tmpl.format(*map(str, keys)) + tmpl.format(*units)
+
+        # one format string per row instead of formatting each value
+        fields, pres = zip(*(
+            _txt_col_field(self._formats.get(k), self._col_width(i))
+            for i, k in enumerate(keys)
+        ))
+        row_fmt = " ".join(fields) + "\n"
+        col_pres = tuple((i, f) for i, f in enumerate(pres) if f)
+        # reused for every row with these keys
+        row_buf = [None] * len(keys)
+
+        return header, row_fmt, col_pres, row_buf
 
     def write_sensordata(self, keys, vals):
         """
         pretty columnized text for terminal output.
         """
 
-        if self._did_keys_change(keys):
-            self.write_row(keys)
+        if keys is not self._prev_keys and self._did_keys_change(keys):
+            # key sets often alternate, only build the layout once per set
+            layout = self._layouts.get(tuple(keys))
+            if layout is None:
+                layout = self._mk_layout(keys)
+                self._layouts[tuple(keys)] = layout
 
-            units = ["({})".format(self.get_unit(k)) for k in keys]
-            self.write_row(units)
+            header, self._row_fmt, self._col_pres, self._row_buf = layout
+            self._batch.write(header)
 
         assert(len(keys) == len(vals))
-        svals = [None] * len(keys)
-        for i, k in enumerate(keys):
-            if k in self._formats:
-                s = self._formats[k].format(vals[i])
-            else:
-                s = str(vals[i])
-            svals[i] = s
+        if self._col_pres:
+            buf = self._row_buf
+            buf[:] = vals
+            for i, f in self._col_pres:
+                buf[i] = f(vals[i])
+            vals = buf
 
-        self.write_row(svals)
+        self._batch.write(self._row_fmt.format(*vals))
+
+
+if orjson is not None:
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    def _json_dumps(obj):
+        return json.dumps(obj)
 
 
 class OutputWriterJson(OutputWriterBase):
@@ -114,27 +217,48 @@ class OutputWriterJson(OutputWriterBase):
         super().__init__(outfile, header, **kwargs)
 
     def _write_obj(self, obj):
-        json.dump(obj, fp=self._outfile)
-        print("\n", end="", file=self._outfile)
+        # one write per object incl. newline
+        self._batch.write(_json_dumps(obj) + "\n")
 
     def write_row(self, vals):
         self._write_obj(vals)
 
     def write_kv(self, d):
         self._write_obj(d)
+        self.flush()
 
 
 class OutputWriterCsv(OutputWriterBase):
     def __init__(self, outfile, header=None, **kwargs):
-        self._csvw = csv.writer(outfile)
-        super().__init__(outfile, header, **kwargs)
+        super().__init__(outfile, header=None, **kwargs)
+        self._csvw = csv.writer(self._batch)
+        self._lineterminator = self._csvw.dialect.lineterminator
+        self._row_fmt = None
+        # ncols -> "{},{},...{}" + lineterminator
+        self._row_templates = {}
+        if header:
+            self.write_row(header)
 
     def write_row(self, vals):
         self._csvw.writerow(vals)
 
+    def _row_template(self, ncols):
+        tmpl = self._row_templates.get(ncols)
+        if tmpl is None:
+            tmpl = ",".join(["{}"] * ncols) + self._lineterminator
+            self._row_templates[ncols] = tmpl
+        return tmpl
+
+    def write_sensordata(self, keys, vals):
+        if keys is not self._prev_keys and self._did_keys_change(keys):
+            self.write_row(keys)
+            self._row_fmt = self._row_template(len(keys))
+        # numbers never need quoting, skip the csv writer for the values
+        self._batch.write(self._row_fmt.format(*vals))
+
     def write_kv(self, d):
-        self.write_row(d.keys())
-        self.write_row(d.values())
+        self._csvw.writerows((d.keys(), d.values()))
+        self.flush()
 
 class OutputWriterDummy(OutputWriterBase):
     def __init__(self, outfile, header=None, **kwargs):
@@ -29,9 +29,9 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     install_requires=[
-        "protobuf",
+        "protobuf >= 4.21",  # upb backend by default
         "intelhex",
         "bleak >= 0.18.1",
     ],
-    python_requires='>=3.4',
+    python_requires='>=3.8',
 )